@@ -1,33 +1,160 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
-from pydantic import BaseModel
+from cachetools import LRUCache, TTLCache
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette.middleware.base import BaseHTTPMiddleware
+from pydantic import BaseModel, conint, field_validator
 from playwright.async_api import async_playwright
+from PIL import Image
 import asyncio
+import base64
+import hashlib
+import hmac
 import io
+import logging
+import math
+import os
+import oxipng
 import re
-from typing import Optional, Set
+import time
+from types import MappingProxyType
+from typing import Literal, Optional
 
 app = FastAPI(title="HTML to Image API", version="1.0.0")
 
+# Defaults to WARNING so per-resource debug messages cost nothing
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger("imageflow")
+
+# Optional bearer token for /convert; the endpoint is open when unset
+API_KEY = os.getenv("API_KEY")
+_API_KEY_BYTES = API_KEY.encode() if API_KEY else None
+
+# auto_error=False so a missing header is handled by verify_api_key
+security = HTTPBearer(auto_error=False)
+
 # Allowed image formats and their MIME types
-ALLOWED_IMAGE_FORMATS = {
+ALLOWED_IMAGE_FORMATS = frozenset({
     'jpg', 'jpeg', 'png', 'gif', 'webp', 'svg', 'bmp', 'ico'
-}
+})
 
-ALLOWED_MIME_TYPES = {
+ALLOWED_MIME_TYPES = frozenset({
     'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 
     'image/webp', 'image/svg+xml', 'image/bmp', 'image/x-icon', 'image/vnd.microsoft.icon'
-}
+})
+
+# Response content type for each output format
+CONTENT_TYPE_MAP = MappingProxyType({
+    "png": "image/png",
+    "jpeg": "image/jpeg"
+})
 
 # File size limit: 500MB
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB in bytes
 
+# Chromium launch arguments with additional security options
+BROWSER_LAUNCH_ARGS = (
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor',
+    '--disable-blink-features=AutomationControlled'
+)
+
+# Realistic user agent and headers to avoid detection
+EXTRA_HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Extracts a Google Drive file ID from any of the supported URL forms
+_DRIVE_ID_RE = re.compile(
+    r'drive\.google\.com/(?:file/d/|open\?id=|uc\?(?:[^"\']*?[&;])?id=)([a-zA-Z0-9_-]+)'
+)
+
+# Matches quoted values that are Google Drive URLs, in both src="..." attributes
+# and JavaScript assignments (like const AVATAR_URL = "..."); values that only
+# contain one, such as style="background:url(...)", are left alone
+_DRIVE_URL_RE = re.compile(
+    r'=(["\'])((?:https?:)?//[^"\']*drive\.google\.com[^"\']+)\1',
+    re.IGNORECASE
+)
+
+# Resolves once web fonts have loaded and every <img> in the document,
+# including ones added by scripts, has decoded (or failed to)
+_WAIT_FOR_FONTS_AND_IMAGES_JS = (
+    "() => Promise.all([document.fonts.ready, "
+    "...[...document.images].map(i => i.decode().catch(() => null))]).then(() => null)"
+)
+
+# Upper bound for loading the page and waiting on its fonts and images
+PAGE_LOAD_TIMEOUT = 30  # seconds
+
+# Default (width, height); pooled contexts are created with this viewport
+DEFAULT_VIEWPORT = (1920, 1080)
+
+# Number of pre-warmed browser contexts kept in the pool
+CONTEXT_POOL_SIZE = int(os.getenv("CTX_POOL", 4))
+
+# Maximum number of conversions rendering at once; defaults to the pool size
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", CONTEXT_POOL_SIZE))
+
+# Memory budget for cached images in megabytes, and how many seconds an
+# image is served from cache before it is rendered again; 0 disables caching
+CACHE_SIZE_MB = int(os.getenv("CACHE_SIZE_MB", 64))
+CACHE_TTL = float(os.getenv("CACHE_TTL", 60))
+CACHE_ENABLED = CACHE_SIZE_MB > 0 and CACHE_TTL > 0
+
+# Rendered images keyed by (html digest, width, height, format, quality, optimize),
+# bounded by total image bytes rather than entry count
+_image_cache = TTLCache(
+    maxsize=max(CACHE_SIZE_MB, 1) * 1024 * 1024,
+    ttl=max(CACHE_TTL, 1),
+    getsizeof=len
+)
+
+# Renders in progress, so identical concurrent requests share one render
+_inflight_renders = {}
+
+# Per-client rate limit for POST /convert: RATE_LIMIT requests per
+# RATE_LIMIT_PERIOD seconds, refilled continuously. Off by default since
+# clients are identified by address, which behind a proxy is only correct
+# when uvicorn trusts its forwarded headers (FORWARDED_ALLOW_IPS)
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", 0))
+RATE_LIMIT_PERIOD = float(os.getenv("RATE_LIMIT_PERIOD", 60))
+RATE_LIMIT_ENABLED = RATE_LIMIT > 0 and RATE_LIMIT_PERIOD > 0
+
+# Token buckets keyed by client address: (tokens, last refill time). The
+# least recently seen clients are evicted first; their buckets would have
+# refilled by the time they return in all but the busiest deployments
+_rate_buckets = LRUCache(maxsize=10000)
+
+# Shared Playwright driver and Chromium instance, started once per process
+_playwright = None
+_browser = None
+_context_pool: Optional[asyncio.Queue] = None
+_browser_lock: Optional[asyncio.Lock] = None
+_render_semaphore: Optional[asyncio.Semaphore] = None
+
 class HTMLRequest(BaseModel):
     html: str
-    width: Optional[int] = 1920
-    height: Optional[int] = 1080
-    format: Optional[str] = "png"
-    quality: Optional[int] = 90
+    width: Optional[int] = DEFAULT_VIEWPORT[0]
+    height: Optional[int] = DEFAULT_VIEWPORT[1]
+    format: Literal["png", "jpeg"] = "png"
+    quality: conint(ge=1, le=100) = 90
+    optimize: bool = False
+
+    @field_validator("format", mode="before")
+    @classmethod
+    def lowercase_format(cls, value):
+        # Accept "PNG" / "JPEG" as before
+        return value.lower() if isinstance(value, str) else value
 
 def convert_google_drive_url(url: str) -> str:
     """
@@ -41,19 +168,11 @@ def convert_google_drive_url(url: str) -> str:
     - https://drive.google.com/uc?export=view&id={ID}
     - https://drive.google.com/uc?export=download&id={ID}
     """
-    # Pattern to extract Google Drive file ID
-    patterns = [
-        r'drive\.google\.com/file/d/([a-zA-Z0-9_-]+)',
-        r'drive\.google\.com/open\?id=([a-zA-Z0-9_-]+)',
-        r'drive\.google\.com/uc\?.*?id=([a-zA-Z0-9_-]+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            file_id = match.group(1)
-            # Convert to lh3.googleusercontent.com format (thumbnail/direct access)
-            return f'https://lh3.googleusercontent.com/d/{file_id}'
+    match = _DRIVE_ID_RE.search(url)
+    if match:
+        file_id = match.group(1)
+        # Convert to lh3.googleusercontent.com format (thumbnail/direct access)
+        return f'https://lh3.googleusercontent.com/d/{file_id}'
     
     # If no pattern matches, return original URL
     return url
@@ -62,43 +181,28 @@ def process_html_urls(html: str) -> str:
     """
     Process HTML content and convert all Google Drive URLs to the proper format
     """
-    # Find all src attributes with Google Drive URLs
-    def replace_drive_url(match):
-        full_match = match.group(0)
-        url = match.group(1)
-        
-        # Check if it's a Google Drive URL
-        if 'drive.google.com' in url:
-            converted_url = convert_google_drive_url(url)
-            return full_match.replace(url, converted_url)
-        
-        return full_match
+    # Most HTML has no Drive links, so skip the regex passes entirely
+    if 'drive.google.com' not in html:
+        return html
     
-    # Pattern to match src="..." or src='...'
-    html = re.sub(r'src=["\']([^"\']+)["\']', replace_drive_url, html)
-    
-    # Also handle URLs in JavaScript variables (like const AVATAR_URL = "...")
-    def replace_js_url(match):
+    # Rewrite src attributes and JavaScript URLs in a single scan
+    def replace_drive_url(match):
         quote = match.group(1)
         url = match.group(2)
-        
-        if 'drive.google.com' in url:
-            converted_url = convert_google_drive_url(url)
-            return f'={quote}{converted_url}{quote}'
-        
-        return match.group(0)
+        converted_url = convert_google_drive_url(url)
+        return f'={quote}{converted_url}{quote}'
     
-    html = re.sub(r'=(["\'])(https?://[^"\']*drive\.google\.com[^"\']+)\1', replace_js_url, html)
+    html = _DRIVE_URL_RE.sub(replace_drive_url, html)
     
     return html
 
 def is_valid_image_format(url: str, content_type: str = None) -> bool:
     """Validate if URL points to an allowed image format"""
-    # Check file extension
-    url_lower = url.lower()
-    for ext in ALLOWED_IMAGE_FORMATS:
-        if f'.{ext}' in url_lower:
-            return True
+    # Check file extension of the path, ignoring query string and fragment
+    path = url.lower().split('?', 1)[0].split('#', 1)[0]
+    dot = path.rfind('.')
+    if dot != -1 and path[dot + 1:] in ALLOWED_IMAGE_FORMATS:
+        return True
     
     # Check MIME type if provided
     if content_type:
@@ -109,16 +213,130 @@ def is_valid_image_format(url: str, content_type: str = None) -> bool:
     # If no clear indication, allow it (let the browser handle it)
     return True
 
-def validate_image_request(request) -> None:
-    """Validate image request for size and format"""
-    # This will be called by Playwright's request handler
-    pass
+async def _new_context():
+    """Create a browser context with the pool's default viewport and headers"""
+    return await _browser.new_context(
+        viewport={"width": DEFAULT_VIEWPORT[0], "height": DEFAULT_VIEWPORT[1]},
+        extra_http_headers=EXTRA_HTTP_HEADERS
+    )
+
+async def _launch_browser():
+    """Launch Chromium on the shared Playwright driver"""
+    return await _playwright.chromium.launch(
+        headless=True,
+        args=BROWSER_LAUNCH_ARGS
+    )
+
+async def _ensure_browser() -> None:
+    """Relaunch Chromium if it crashed or was killed since the last request"""
+    global _browser
+    async with _browser_lock:
+        if not _browser.is_connected():
+            logger.warning("Chromium disconnected, relaunching")
+            _browser = await _launch_browser()
+
+def _is_stale(context) -> bool:
+    """Whether a pooled context belongs to a browser that has gone away"""
+    return context.browser is None or not context.browser.is_connected()
+
+async def _recycle_context(context):
+    """Close a context that errored out and return a fresh replacement"""
+    try:
+        await context.close()
+    except Exception:
+        pass
+    return await _new_context()
+
+async def verify_api_key(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> None:
+    """Require a matching bearer token when API_KEY is configured"""
+    if _API_KEY_BYTES is None:
+        return
+    
+    # Constant-time comparison to avoid leaking the key through timing
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), _API_KEY_BYTES):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing API key",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+@app.on_event("startup")
+async def start_browser():
+    """Launch a long-lived Chromium instance shared by all requests"""
+    global _playwright, _browser, _context_pool, _render_semaphore, _browser_lock
+    _playwright = await async_playwright().start()
+    _browser = await _launch_browser()
+    _browser_lock = asyncio.Lock()
+    
+    # Pre-warm the context pool
+    _context_pool = asyncio.Queue(maxsize=CONTEXT_POOL_SIZE)
+    for _ in range(CONTEXT_POOL_SIZE):
+        await _context_pool.put(await _new_context())
+    
+    # Excess requests queue here instead of piling onto Chromium
+    _render_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+@app.on_event("shutdown")
+async def stop_browser():
+    """Close the shared Chromium instance and stop the Playwright driver"""
+    global _playwright, _browser, _context_pool
+    # Closing the browser also closes every pooled context
+    _context_pool = None
+    if _browser is not None:
+        await _browser.close()
+        _browser = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+
+def _take_rate_token(client: str) -> float:
+    """
+    Take a token from the client's bucket
+    
+    Returns 0 when the request is allowed, otherwise the number of seconds
+    until a token becomes available.
+    """
+    now = time.monotonic()
+    refill_rate = RATE_LIMIT / RATE_LIMIT_PERIOD
+    
+    tokens, last = _rate_buckets.get(client, (RATE_LIMIT, now))
+    tokens = min(RATE_LIMIT, tokens + (now - last) * refill_rate)
+    
+    if tokens < 1:
+        _rate_buckets[client] = (tokens, now)
+        return (1 - tokens) / refill_rate
+    
+    _rate_buckets[client] = (tokens - 1, now)
+    return 0
+
+async def rate_limit_convert(request: Request, call_next):
+    """
+    Reject over-limit /convert calls before any body parsing or Chromium work
+    
+    Cache hits count against the limit too: the check runs before the body
+    is read, so it can't tell them apart.
+    """
+    if request.method == "POST" and request.url.path == "/convert":
+        client = request.client.host if request.client else "unknown"
+        retry_after = _take_rate_token(client)
+        if retry_after:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded"},
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+    
+    return await call_next(request)
+
+# Only installed when enabled, so other requests don't pay for the wrapper
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(BaseHTTPMiddleware, dispatch=rate_limit_convert)
 
 @app.get("/")
 async def root():
     return {"message": "HTML to Image API", "version": "1.0.0", "endpoint": "POST /convert"}
 
-@app.post("/convert", response_class=Response)
+@app.post("/convert", response_class=Response, dependencies=[Depends(verify_api_key)])
 async def convert_html_to_image(request: HTMLRequest):
     """
     Convert HTML to image (PNG or JPEG) with external image support
@@ -128,6 +346,7 @@ async def convert_html_to_image(request: HTMLRequest):
     - **height**: Image height in pixels (default: 1080)
     - **format**: Output format - png or jpeg (default: png)
     - **quality**: Image quality 1-100 (default: 90)
+    - **optimize**: Losslessly recompress PNG output with oxipng for smaller files at the cost of latency (default: false)
     
     **External Image Support:**
     - Supports external images from any domain
@@ -136,144 +355,246 @@ async def convert_html_to_image(request: HTMLRequest):
     - Maximum file size: 500MB per image
     - Automatically validates content type and file format
     """
+    # Format and quality are already validated by HTMLRequest
+    fmt = request.format
+    
     try:
-        # Validate format
-        valid_formats = ["png", "jpeg"]
-        if request.format.lower() not in valid_formats:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid format. Must be one of: {', '.join(valid_formats)}"
-            )
-        
-        # Validate quality
-        if not (1 <= request.quality <= 100):
-            raise HTTPException(
-                status_code=400,
-                detail="Quality must be between 1 and 100"
-            )
+        image_data = await render_cached(request)
         
-        # Process HTML to convert Google Drive URLs
-        processed_html = process_html_urls(request.html)
+        # Starlette sends bytes content as-is without copying; keep image_data
+        # as bytes (a memoryview would fail in Response.render on this version)
+        return Response(
+            content=image_data,
+            media_type=CONTENT_TYPE_MAP[fmt]
+        )
         
-        # Convert HTML to image
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
+
+async def render_cached(request: HTMLRequest) -> bytes:
+    """
+    Render a request, serving recent repeats from the in-memory cache
+    
+    Concurrent requests for the same key share one render task. The task
+    isn't owned by any single request, so cancelling one caller doesn't
+    cancel the render for the others.
+    """
+    html_digest = hashlib.blake2b(request.html.encode(), digest_size=16).digest()
+    # quality only affects JPEG and optimize only PNG, so normalise the
+    # other so equivalent requests share one entry and one render
+    quality = request.quality if request.format == "jpeg" else None
+    optimize = request.optimize and request.format == "png"
+    key = (html_digest, request.width, request.height, request.format, quality, optimize)
+    
+    image_data = _image_cache.get(key)
+    if image_data is not None:
+        return image_data
+    
+    task = _inflight_renders.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_and_cache(key, request))
+        _inflight_renders[key] = task
+        task.add_done_callback(lambda done: _finish_render(key, done))
+    
+    return await asyncio.shield(task)
+
+async def _render_and_cache(key, request: HTMLRequest) -> bytes:
+    """Render a request and store the result in the cache"""
+    # Process HTML to convert Google Drive URLs
+    processed_html = process_html_urls(request.html)
+    
+    # Chromium's JPEG encoder always subsamples chroma to 4:2:0, so
+    # high-quality JPEGs are captured losslessly and encoded once below
+    high_quality_jpeg = request.format == "jpeg" and request.quality >= 90
+    
+    # Convert HTML to image
+    async with _render_semaphore:
         image_data = await html_to_image(
             html=processed_html,
             width=request.width,
             height=request.height,
-            format=request.format.lower(),
+            format="png" if high_quality_jpeg else request.format,
             quality=request.quality
         )
-        
-        # Determine content type
-        content_type_map = {
-            "png": "image/png",
-            "jpeg": "image/jpeg"
-        }
-        
-        return Response(
-            content=image_data,
-            media_type=content_type_map[request.format.lower()]
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
+    
+    # Post-processing is CPU-bound, so it runs in the default executor
+    # after the context and semaphore slot are free for the next render
+    loop = asyncio.get_running_loop()
+    
+    # High-quality JPEGs are encoded from the PNG capture as progressive 4:4:4
+    if high_quality_jpeg:
+        image_data = await loop.run_in_executor(None, encode_jpeg, image_data, request.quality)
+    
+    # Optional lossless PNG recompression
+    if request.format == "png" and request.optimize:
+        image_data = await loop.run_in_executor(None, optimize_png, image_data)
+    
+    # Images larger than the whole budget are simply not cached
+    if CACHE_ENABLED and len(image_data) <= _image_cache.maxsize:
+        _image_cache[key] = image_data
+    return image_data
+
+def _finish_render(key, task) -> None:
+    """Drop a finished render from the in-flight map"""
+    del _inflight_renders[key]
+    # Mark the error as retrieved in case every caller went away first
+    if not task.cancelled():
+        task.exception()
 
 async def html_to_image(html: str, width: int, height: int, format: str, quality: int) -> bytes:
     """Convert HTML string to image bytes using Playwright with external image validation"""
-    async with async_playwright() as p:
-        # Launch browser with additional security options
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--disable-web-security',
-                '--disable-features=VizDisplayCompositor',
-                '--disable-blink-features=AutomationControlled'
-            ]
-        )
-        page = await browser.new_page()
-        
-        # Set realistic user agent and headers to avoid detection
-        await page.set_extra_http_headers({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        })
+    # Check out a pre-warmed context; waits here when the pool is exhausted
+    context = await _context_pool.get()
+    
+    # Set up response handler to validate external images
+    async def handle_response(response):
+        url = response.url
+        resource_type = response.request.resource_type
         
-        # Set up response handler to validate external images
-        async def handle_response(response):
-            url = response.url
-            resource_type = response.request.resource_type
+        # Only validate image requests
+        if resource_type in ['image', 'media'] and url.startswith(('http://', 'https://')):
+            if response.status >= 400:
+                logger.debug("Failed to load image: %s (Status: %s)", url, response.status)
+                return
+            
+            # Check content type
+            content_type = response.headers.get('content-type', '')
+            if not is_valid_image_format(url, content_type):
+                logger.debug("Blocking resource with invalid content type: %s (%s)", url, content_type)
+                return
             
-            # Only validate image requests
-            if resource_type in ['image', 'media'] and url.startswith(('http://', 'https://')):
-                if response.status >= 400:
-                    print(f"Failed to load image: {url} (Status: {response.status})")
-                    return
-                
-                # Check content type
-                content_type = response.headers.get('content-type', '')
-                if not is_valid_image_format(url, content_type):
-                    print(f"Blocking resource with invalid content type: {url} ({content_type})")
-                    return
-                
-                # Check content length
-                content_length = response.headers.get('content-length')
-                if content_length and int(content_length) > MAX_FILE_SIZE:
-                    print(f"Blocking oversized resource: {url} ({content_length} bytes)")
-                    return
-                
-                print(f"Loading external image: {url} ({content_type})")
+            # Check content length
+            content_length = response.headers.get('content-length')
+            if content_length and int(content_length) > MAX_FILE_SIZE:
+                logger.debug("Blocking oversized resource: %s (%s bytes)", url, content_length)
+                return
+            
+            logger.debug("Loading external image: %s (%s)", url, content_type)
+    
+    try:
+        # Contexts from a crashed browser are replaced once it's relaunched
+        await _ensure_browser()
+        if _is_stale(context):
+            context = await _new_context()
         
-        # Set up response handler
-        page.on('response', handle_response)
+        page = await context.new_page()
         
-        try:
-            # Set viewport size
+        # The handler only produces debug logs, and every event it receives
+        # is a round trip to Python, so only attach it when they're wanted
+        if logger.isEnabledFor(logging.DEBUG):
+            page.on('response', handle_response)
+        
+        # Skip the CDP round-trip when the pooled default already matches
+        if (width, height) != DEFAULT_VIEWPORT:
             await page.set_viewport_size({"width": width, "height": height})
-            
-            # Set a timeout for page load
-            page.set_default_timeout(30000)  # 30 seconds
-            
-            # Set HTML content
-            await page.set_content(html, wait_until="networkidle")
-            
-            # Take screenshot
-            screenshot_options = {
-                "type": format,
-                "quality": quality if format != "png" else None,  # PNG doesn't support quality
-                "full_page": True
+        
+        # Set a timeout for page load
+        page.set_default_timeout(PAGE_LOAD_TIMEOUT * 1000)
+        
+        # Set HTML content
+        # "load" covers stylesheets and CSS backgrounds, and unlike
+        # "networkidle" doesn't add 500ms of idle time for static HTML
+        await page.set_content(html, wait_until="load")
+        
+        # Then wait for fonts and images to be ready to paint; the default
+        # timeout doesn't cover evaluate, so bound it here
+        try:
+            await asyncio.wait_for(page.evaluate(_WAIT_FOR_FONTS_AND_IMAGES_JS), PAGE_LOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            # wait_for's TimeoutError has no message of its own
+            raise TimeoutError(f"Timed out after {PAGE_LOAD_TIMEOUT}s waiting for fonts/images") from None
+        
+        # Take screenshot through CDP so Chromium uses its fast encoders
+        image_bytes = await capture_screenshot(
+            page, format, quality if format == "jpeg" else None  # PNG doesn't support quality
+        )
+        await page.close()
+        
+    except Exception as e:
+        logger.error("Error during image conversion: %s", e)
+        # Don't hand a possibly broken context back to the pool
+        context = await _recycle_context(context)
+        raise e
+    finally:
+        await _context_pool.put(context)
+    
+    return image_bytes
+
+async def capture_screenshot(page, format: str, quality: Optional[int] = None) -> bytes:
+    """
+    Take a full-page screenshot through the Chrome DevTools Protocol
+    
+    Unlike page.screenshot(), this lets us pass optimizeForSpeed so Chromium
+    encodes with fast zlib settings instead of its default high compression.
+    """
+    cdp = await page.context.new_cdp_session(page)
+    try:
+        # Clip to the full document size, same as full_page=True
+        metrics = await cdp.send("Page.getLayoutMetrics")
+        content_size = metrics.get("cssContentSize") or metrics["contentSize"]
+        params = {
+            "format": format,
+            "optimizeForSpeed": True,
+            "captureBeyondViewport": True,
+            "clip": {
+                "x": 0,
+                "y": 0,
+                "width": math.ceil(content_size["width"]),
+                "height": math.ceil(content_size["height"]),
+                "scale": 1
             }
-            
-            # Remove quality for PNG
-            if format == "png":
-                screenshot_options.pop("quality", None)
-            
-            image_bytes = await page.screenshot(**screenshot_options)
-            return image_bytes
-            
-        except Exception as e:
-            print(f"Error during image conversion: {str(e)}")
-            raise e
-        finally:
-            await browser.close()
+        }
+        
+        # Quality only applies to JPEG
+        if quality is not None:
+            params["quality"] = quality
+        
+        result = await cdp.send("Page.captureScreenshot", params)
+    finally:
+        await cdp.detach()
+    
+    return base64.b64decode(result["data"])
+
+def encode_jpeg(png_data: bytes, quality: int) -> bytes:
+    """Encode PNG bytes as a progressive JPEG with optimized Huffman tables and no chroma subsampling"""
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(png_data)) as img:
+        # JPEG has no alpha channel
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=quality, progressive=True, optimize=True, subsampling=0)
+    # getvalue() hands over the internal buffer without copying as long as no
+    # getbuffer() view is alive; bytes(out.getbuffer()) would copy instead
+    return out.getvalue()
+
+def optimize_png(data: bytes) -> bytes:
+    """Losslessly recompress PNG bytes with oxipng"""
+    return oxipng.optimize_from_memory(data, level=2)
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint; also relaunches Chromium if it has gone away"""
+    try:
+        await _ensure_browser()
+    except Exception as e:
+        logger.error("Chromium relaunch failed: %s", e)
+        return JSONResponse(status_code=503, content={"status": "unhealthy"})
     return {"status": "healthy"}
 
 if __name__ == "__main__":
     import uvicorn
-    import os
     
     # Get port from environment variable (Railway provides this)
     port = int(os.environ.get("PORT", 8000))
     
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # Each worker runs the startup handler and gets its own browser and context pool
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", 1))
+    )
\ No newline at end of file
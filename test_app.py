@@ -0,0 +1,79 @@
+import pytest
+from cachetools import LRUCache
+
+import app
+from app import _take_rate_token, process_html_urls
+
+
+def test_rewrites_drive_src_attributes():
+    html = (
+        '<img src="https://drive.google.com/file/d/AbC_1-2/view?usp=sharing">'
+        "<img src='https://drive.google.com/open?id=XYZ'>"
+        '<img src="https://drive.google.com/uc?export=view&amp;id=QQ1">'
+        '<img src="//drive.google.com/uc?export=download&id=QQ2">'
+    )
+    assert process_html_urls(html) == (
+        '<img src="https://lh3.googleusercontent.com/d/AbC_1-2">'
+        "<img src='https://lh3.googleusercontent.com/d/XYZ'>"
+        '<img src="https://lh3.googleusercontent.com/d/QQ1">'
+        '<img src="https://lh3.googleusercontent.com/d/QQ2">'
+    )
+
+
+def test_rewrites_drive_urls_in_javascript():
+    html = '<script>const AVATAR_URL ="https://drive.google.com/uc?id=Z9";</script>'
+    assert process_html_urls(html) == (
+        '<script>const AVATAR_URL ="https://lh3.googleusercontent.com/d/Z9";</script>'
+    )
+
+
+def test_leaves_values_that_only_contain_a_drive_url():
+    html = '<div style="background:url(https://drive.google.com/file/d/ABC/view)"></div>'
+    assert process_html_urls(html) == html
+
+
+def test_leaves_non_file_drive_links_and_other_urls():
+    html = (
+        '<a href="https://drive.google.com/drive/folders/xyz">x</a>'
+        '<img src="https://example.com/a.png">'
+    )
+    assert process_html_urls(html) == html
+
+
+@pytest.fixture
+def rate_limit(monkeypatch):
+    # 2 requests per 10s, so one token refills every 5s
+    clock = [100.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(app, "RATE_LIMIT", 2)
+    monkeypatch.setattr(app, "RATE_LIMIT_PERIOD", 10.0)
+    monkeypatch.setattr(app, "_rate_buckets", LRUCache(maxsize=10))
+    return clock
+
+
+def test_rate_limit_allows_a_burst_then_reports_retry_after(rate_limit):
+    assert _take_rate_token("client") == 0
+    assert _take_rate_token("client") == 0
+    assert _take_rate_token("client") == pytest.approx(5)
+
+
+def test_rate_limit_keeps_separate_buckets_per_client(rate_limit):
+    _take_rate_token("client")
+    _take_rate_token("client")
+    assert _take_rate_token("client") > 0
+    assert _take_rate_token("other") == 0
+
+
+def test_rate_limit_refills_over_time(rate_limit):
+    _take_rate_token("client")
+    _take_rate_token("client")
+    rate_limit[0] += 2.5
+    assert _take_rate_token("client") == pytest.approx(2.5)
+    rate_limit[0] += 2.5
+    assert _take_rate_token("client") == 0
+    assert _take_rate_token("client") == pytest.approx(5)
+    # Refills never exceed the burst size
+    rate_limit[0] += 60
+    assert _take_rate_token("client") == 0
+    assert _take_rate_token("client") == 0
+    assert _take_rate_token("client") > 0